@@ -6,14 +6,18 @@ A simple command-line interface for natural language database queries
 with human-in-the-loop approval for query execution.
 """
 
+import asyncio
 import os
+import uuid
+from contextlib import AsyncExitStack
 
 from dotenv import load_dotenv
 load_dotenv()
 
 
 # LangSmith tracing is controlled by environment variables in .env file
-yolo_mode=os.environ.get("YOLLO_MODE", "False")
+# parsed once to a real bool so the graph state never has to coerce a string
+yolo_mode = os.environ.get("YOLLO_MODE", "false").strip().lower() in ("1", "true", "yes", "y")
 
 companyId = os.environ.get("COMPANY_ID", "unknown")
 
@@ -27,7 +31,7 @@ from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.graph import StateGraph
 from langchain_core.messages import HumanMessage, AIMessageChunk
 from typing import AsyncGenerator
-from config import mcp_config
+from config import get_mcp_config
 from demo_agent import build_agent_graph, PrismaAgentState, ReviewAction
 from langgraph.types import Command;
 from langchain_core.runnables.config import RunnableConfig
@@ -36,6 +40,13 @@ import json
 
 print(f"companyId loaded from env: {companyId} ")
 
+# Minimum amount of streamed text to accumulate before handing it to the caller
+STREAM_FLUSH_BYTES = 64
+
+# Accepted approval actions, computed once for O(1) membership checks
+_VALID_ACTIONS = frozenset(a.value for a in ReviewAction)
+_ACTION_PROMPT = f"Action ({', '.join(a.value for a in ReviewAction)}): "
+
 
 
 
@@ -44,32 +55,63 @@ async def stream_graph_response(
         ) -> AsyncGenerator[str, None]:
     """
     Stream the response from the graph while parsing out tool calls.
+
+    Content tokens are coalesced into ~STREAM_FLUSH_BYTES chunks so the caller
+    prints (and flushes) once per batch instead of once per token.
     """
+    buf: list[str] = []
+    buf_len = 0
     async for message_chunk, metadata in graph.astream(
         input=input,
         stream_mode="messages",
         config=config
         ):
         if isinstance(message_chunk, AIMessageChunk):
-            if message_chunk.response_metadata:
-                finish_reason = message_chunk.response_metadata.get("finish_reason", "")
+            # hot loop: read each attribute once into a local
+            rm = message_chunk.response_metadata
+            tc = message_chunk.tool_call_chunks
+            content = message_chunk.content
+
+            finish_reason = ""
+            if rm:
+                finish_reason = rm.get("finish_reason", "")
                 if finish_reason == "tool_calls":
-                    yield "\n"
-
-            if message_chunk.tool_call_chunks:
-                tool_chunk = message_chunk.tool_call_chunks[0]
-                tool_name = tool_chunk.get("name", "")
-                args = tool_chunk.get("args", "")
-                
-                if tool_name:
-                    yield f"\n[TOOL: {tool_name}]\n"
-                    
-                if args:
-                    yield args
-            else:
-                yield message_chunk.content
+                    buf.append("\n")
+                    buf_len += 1
+
+            if tc:
+                # providers with parallel tool calls may pack several fragments into one chunk
+                for tool_chunk in tc:
+                    tool_name = tool_chunk.get("name")
+                    args = tool_chunk.get("args")
+
+                    # pending text, tool marker and args go out as a single yield
+                    if tool_name:
+                        buf.append(f"\n[TOOL: {tool_name}]\n")
+                    if args:
+                        buf.append(args)
+                if buf:
+                    yield "".join(buf)
+                    buf.clear()
+                    buf_len = 0
+            elif content:
+                buf.append(content)
+                buf_len += len(content)
+
+            if buf and (buf_len >= STREAM_FLUSH_BYTES or finish_reason):
+                yield "".join(buf)
+                buf.clear()
+                buf_len = 0
             continue
 
+    if buf:
+        yield "".join(buf)
+
+
+async def ainput(prompt: str = "") -> str:
+    """Read a line from stdin without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, input, prompt)
+
 
 def print_welcome():
     """Print welcome message."""
@@ -103,20 +145,29 @@ async def handle_human_approval(interrupt_data: dict) -> dict:
     print(f"Query Type: {query_info.get('type', 'unknown')}")
     print(f"Description: {query_info.get('description', 'No description')}")
     
-    query = query_info.get('query', 'No query provided')
-    print(f"\nGenerated Query:")
-    print(f"{query}\n")
+    queries = query_info.get('queries')
+    if queries:
+        print(f"\nGenerated Quer{'y' if len(queries) == 1 else 'ies'}:")
+        for i, query in enumerate(queries, 1):
+            prefix = f"[{i}] " if len(queries) > 1 else ""
+            print(f"{prefix}{query.get('sql_query', '')}")
+            if query.get('params'):
+                print(f"{' ' * len(prefix)}Params: {query['params']}")
+        print()
+    else:
+        query = query_info.get('query', 'No query provided')
+        print(f"\nGenerated Query:")
+        print(f"{query}\n")
     print_approval_instructions()
     action = ""
     data = None
     
 
     #ok, this is important as if user f es up the action, we'll be routed to lala land by the graph
-    valid_actions = [action.value for action in ReviewAction]
-    while action not in valid_actions:
+    while action not in _VALID_ACTIONS:
         print("Invalid action. Please try again." if action else "")
         
-        action = input(f"Action ({', '.join(valid_actions)}): ").strip().lower()
+        action = (await ainput(_ACTION_PROMPT)).strip().lower()
     
     if action == ReviewAction.EXIT.value:
         return {"action": "exit"}
@@ -125,34 +176,53 @@ async def handle_human_approval(interrupt_data: dict) -> dict:
     if action == ReviewAction.UPDATE.value:
         print("\nUpdate Instructions:")
         print("Provide the new query parameters as JSON, or describe the changes you want:")
-        data = input("Update data: ").strip()
+        data = (await ainput("Update data: ")).strip()
         
     elif action == ReviewAction.FEEDBACK.value:
         print("\nFeedback Instructions:")
         print("Describe what's wrong with the query or how it should be improved:")
-        data = input("Your feedback: ").strip()
+        data = (await ainput("Your feedback: ")).strip()
 
     return {"action": action, "data": data}
 
 
+async def open_checkpointer(stack: AsyncExitStack):
+    """Open the sqlite checkpointer when CHECKPOINT_DB is set, otherwise None (graph uses MemorySaver).
+
+    MemorySaver keeps every checkpoint in memory forever; sqlite bounds RAM on long sessions.
+    The saver's connection is registered on the stack so it is closed when the session ends.
+    """
+    db_path = os.environ.get("CHECKPOINT_DB")
+    if not db_path:
+        return None
+
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    return await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(db_path))
+
+
 async def main():
     """
     Initialize the MCP client and run the agent conversation loop.
 
     The MultiServerMCPClient allows connection to multiple MCP servers using a single client and config.
     """
+    stack = AsyncExitStack()
     try:
         print_welcome()
         
         print("Initializing Prisma Query Agent...")
         
         client = MultiServerMCPClient(
-            connections=mcp_config
+            connections=get_mcp_config()
         )
         
         # Get all tools (this should include both regular tools and resource access tools)
-        tools = await client.get_tools()
-        resource_list = await client.get_resources("prisma")
+        # tools and resources are independent round trips, so fetch them concurrently
+        tools, resource_list = await asyncio.gather(
+            client.get_tools(),
+            client.get_resources("prisma")
+        )
         if resource_list:
             # Assuming you want to get the first resource. You might need to loop through them.
             first_resource = resource_list[0]
@@ -167,13 +237,20 @@ async def main():
         # Debug: Print available tools to see what we have
         print(f"Available tools: {[tool.name for tool in tools]}")
         
-        graph = build_agent_graph(tools=tools, resources=resource_list or [], companyId=companyId)
+        checkpointer = await open_checkpointer(stack)
+        graph = build_agent_graph(
+            tools=tools,
+            resources=resource_list or [],
+            companyId=companyId,
+            checkpointer=checkpointer
+        )
 
-        # pass a config with a thread_id to use memory
+        # pass a config with a thread_id to use memory; a fresh id per session so a persisted
+        # sqlite checkpointer never resumes an old thread (e.g. one left at an approval prompt)
         graph_config = RunnableConfig(
             recursion_limit=25,
             configurable = {
-                "thread_id": "1"
+                "thread_id": str(uuid.uuid4())
             }
         )
         
@@ -199,11 +276,12 @@ async def main():
                 print(response, end="", flush=True)
 
             # interrupt() throws internal exception(under the hood), LangGraph catches it and stores interrupt data in state
-            thread_state = graph.get_state(config=graph_config)
+            thread_state = await graph.aget_state(config=graph_config)
 
             # Check if there are any interrupts
             while thread_state.interrupts:
-                # you know in case there are multiple interrupts- haven't figured the parralel tool call yet!
+                # collect every pending approval first, then resume the graph once for the batch
+                approvals = {}
                 for interrupt in thread_state.interrupts:
                     # Handle human approval with enhanced interface
                     approval_result = await handle_human_approval(interrupt.value)
@@ -212,17 +290,22 @@ async def main():
                         print("\nSession terminated by user.")
                         return
 
-                    # Resume the graph with human decision
-                    print("\nPrismaGPT: ", end="")
-                    async for response in stream_graph_response(
-                        input=Command(resume=approval_result), 
-                        graph=graph, 
-                        config=graph_config
-                    ):
-                        print(response, end="", flush=True)
+                    approvals[interrupt.id] = approval_result
+
+                # a lone interrupt resumes with its value, parallel ones are keyed by interrupt id
+                resume = approval_result if len(approvals) == 1 else approvals
+
+                # Resume the graph with human decision
+                print("\nPrismaGPT: ", end="")
+                async for response in stream_graph_response(
+                    input=Command(resume=resume), 
+                    graph=graph, 
+                    config=graph_config
+                ):
+                    print(response, end="", flush=True)
 
-                    # Update thread state
-                    thread_state = graph.get_state(config=graph_config)
+                # Update thread state
+                thread_state = await graph.aget_state(config=graph_config)
 
             # Get next user input
             print("\n\nYou: ", end="")
@@ -238,8 +321,8 @@ async def main():
                 print("Please enter a query or type 'help' for assistance.")
                 continue
 
-            # Set up input for next iteration
-            graph_input = PrismaAgentState(
+            # Set up input for next iteration (fields are already well-typed, skip validation)
+            graph_input = PrismaAgentState.model_construct(
                 messages=[HumanMessage(content=user_input)],
                 yolo_mode=yolo_mode
             )
@@ -250,8 +333,9 @@ async def main():
         print(f"\nError: {type(e).__name__}: {str(e)}")
         print("Please check your configuration and try again.")
         raise
+    finally:
+        await stack.aclose()
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
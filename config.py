@@ -1,10 +1,36 @@
 import os
 import json
 import re
+from functools import cache
+from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # optional speedup, stdlib json works fine for the config
+    orjson = None
 
-with open(os.path.join(os.path.dirname(__file__), "mcp_config.json"), "r") as f:
-    mcp_config = json.load(f)
+CONFIG_PATH = Path(__file__).with_name("mcp_config.json")
+
+
+# Matches ${VAR} placeholders anywhere in an argument string
+_ENV_VAR_RE = re.compile(r'\$\{([^}]+)\}')
+
+
+def _replace_env_var(match: re.Match) -> str:
+    """Substitute a single ${VAR} match with its environment value or default"""
+    env_var = match.group(1)
+    env_value = os.environ.get(env_var, "")
+    # Provide defaults for required variables
+    if env_value == "":
+        if env_var == "PRISMA_SCHEMA_PATH":
+            return "/Users/sj124894/playground/agents/schema.prisma"
+        elif env_var == "DATABASE_URL":
+            return "postgresql://localhost:5432/demo"  # Demo default
+        elif env_var == "WORKSPACE":
+            return os.path.dirname(__file__)  # Use current project directory
+        else:
+            raise ValueError(f"Environment variable {env_var} is not set")
+    return env_value
 
 
 def resolve_env_vars(config: dict):
@@ -22,25 +48,14 @@ def resolve_env_vars(config: dict):
                     
         if "args" in server_config:
             for i, arg in enumerate(server_config["args"]):
-                # Handle ${VAR} patterns anywhere in the string
-                def replace_env_var(match):
-                    env_var = match.group(1)
-                    env_value = os.environ.get(env_var, "")
-                    # Provide defaults for required variables
-                    if env_value == "":
-                        if env_var == "PRISMA_SCHEMA_PATH":
-                            return "/Users/sj124894/playground/agents/schema.prisma"
-                        elif env_var == "DATABASE_URL":
-                            return "postgresql://localhost:5432/demo"  # Demo default
-                        elif env_var == "WORKSPACE":
-                            return os.path.dirname(__file__)  # Use current project directory
-                        else:
-                            raise ValueError(f"Environment variable {env_var} is not set")
-                    return env_value
-
                 # Replace all ${VAR} patterns in the string
-                config[server]["args"][i] = re.sub(r'\$\{([^}]+)\}', replace_env_var, arg)
+                config[server]["args"][i] = _ENV_VAR_RE.sub(_replace_env_var, arg)
     return config
 
 
-mcp_config = resolve_env_vars(mcp_config)
+@cache
+def get_mcp_config() -> dict:
+    """Load mcp_config.json and resolve its env vars on first use, then reuse it"""
+    raw = CONFIG_PATH.read_bytes()
+    config = orjson.loads(raw) if orjson else json.loads(raw)
+    return resolve_env_vars(config)
@@ -18,7 +18,7 @@ import json
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from config import mcp_config
+from config import get_mcp_config
 
 
 class ReviewAction(Enum):
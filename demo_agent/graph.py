@@ -3,7 +3,7 @@ import time
 from pydantic import BaseModel
 from typing import Annotated, List, Literal
 from enum import Enum
-from langchain_openai import ChatOpenAI
+from functools import lru_cache
 from langchain_core.messages import (
     BaseMessage,
     SystemMessage,
@@ -19,8 +19,14 @@ from langchain_mcp_adapters.client import MultiServerMCPClient
 import json
 import sys
 import os
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-from config import mcp_config
+from config import get_mcp_config
 
 
 class ReviewAction(Enum):
@@ -38,34 +44,165 @@ class PrismaAgentState(BaseModel):
     
     Attributes:
         messages: The list of messages in the conversation.
-        protected_tools: The list of tools that require human review.
+        protected_tools: The set of tools that require human review.
         yolo_mode: true means be a little rouge .
     """
     messages: Annotated[List[BaseMessage], add_messages] = []
-    protected_tools: List[str] = [
-        "executeQuery"
-    ]
+    protected_tools: frozenset[str] = frozenset({
+        "executeQuery",
+        "executeQueries"
+    })
     attempt:int = 0
     max_attempts:int = 3
     yolo_mode: bool = True
 
 
-def build_agent_graph(tools: List = [], resources: List = [], companyId: str = "unknown"):
+# (name, description) -> serialized tool summary, shared across graph rebuilds
+_TOOL_JSON_CACHE: dict[tuple[str, str], str] = {}
+
+
+def _dump_tool(tool) -> str:
+    """Serialize a tool's name and description for the system prompt, memoized.
+
+    Tools are pydantic models and not hashable, so the cache is keyed on the
+    two fields that make up the dump rather than on the tool itself.
+    """
+    key = (tool.name, tool.description)
+    dumped = _TOOL_JSON_CACHE.get(key)
+    if dumped is None:
+        dumped = _TOOL_JSON_CACHE[key] = tool.model_dump_json(include=["name", "description"])
+    return dumped
+
+
+def _review_queries(args: dict) -> list[dict]:
+    """Each SQL statement and its bound params, covering both executeQuery and batched executeQueries"""
+    if "sql_query" in args:
+        return [{"sql_query": args["sql_query"], "params": args.get("params")}]
+    return [
+        {"sql_query": query.get("sql_query", ""), "params": query.get("params")}
+        for query in args.get("queries") or []
+    ]
+
+
+def _review_continue(last_message: AIMessage, tool_call: dict, review_data) -> Command:
+    """Approve the query execution as-is"""
+    return Command(goto="tools")
+
+
+def _review_update(last_message: AIMessage, tool_call: dict, review_data) -> Command:
+    """Re-issue the tool call with the user-supplied query parameters"""
+    if review_data is None:
+        raise ValueError("update action requires data")
+
+    updated_message = AIMessage(
+        content=last_message.content,
+        tool_calls=[{
+            "id": tool_call["id"],
+            "name": tool_call["name"],
+            "args": _loads(review_data)
+        }],
+        id=last_message.id
+    )
+    return Command(goto="tools", update={"messages": [updated_message]})
+
+
+def _review_feedback(last_message: AIMessage, tool_call: dict, review_data) -> Command:
+    """Send the user's feedback back to the agent"""
+    if review_data is None:
+        raise ValueError("feedback action requires data")
+
+    tool_message = ToolMessage(
+        content=review_data,
+        name=tool_call["name"],
+        tool_call_id=tool_call["id"]
+    )
+    return Command(goto="assistant_node", update={"messages": [tool_message]})
+
+
+def _review_reject(last_message: AIMessage, tool_call: dict, review_data) -> Command:
+    """Reject the query execution"""
+    tool_message = ToolMessage(
+        content="The query execution was rejected by the user. Please ask for clarification or suggest alternative approaches.",
+        name=tool_call["name"],
+        tool_call_id=tool_call["id"]
+    )
+    return Command(goto="assistant_node", update={"messages": [tool_message]})
+
+
+# review action -> handler, looked up once per approval instead of walking a match ladder
+_REVIEW_HANDLERS = {
+    ReviewAction.CONTINUE.value: _review_continue,
+    "c": _review_continue,
+    "C": _review_continue,
+    ReviewAction.UPDATE.value: _review_update,
+    ReviewAction.FEEDBACK.value: _review_feedback,
+    ReviewAction.REJECT.value: _review_reject,
+}
+
+
+@lru_cache(maxsize=1)
+def _base_llm():
+    """Chat model shared by every graph build; model and temperature are fixed."""
+    # imported here so importing the package doesn't pay for the OpenAI client
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model="gpt-4.1-mini-2025-04-14",
+        temperature=0.1,
+    )
+
+
+class _ToolsKey:
+    """Hashable, identity-based key for a list of (unhashable pydantic) tools.
+
+    Holding the tuple keeps the tools alive, so their ids can't be reused
+    while the key sits in the cache.
+    """
+    __slots__ = ("tools", "_hash")
+
+    def __init__(self, tools: List):
+        self.tools = tuple(tools)
+        self._hash = hash(tuple(id(tool) for tool in self.tools))
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, _ToolsKey)
+            and len(self.tools) == len(other.tools)
+            and all(a is b for a, b in zip(self.tools, other.tools))
+        )
+
+
+@lru_cache(maxsize=8)
+def _tool_node_for(tools_key: _ToolsKey) -> ToolNode:
+    """Build the ToolNode for a tools list once and reuse it across graph rebuilds."""
+    return ToolNode(list(tools_key.tools))
+
+
+def build_agent_graph(tools: List = [], resources: List = [], companyId: str = "unknown", checkpointer=None):
     """
     Build the LangGraph application with provided tools and resources.
+
+    checkpointer defaults to an in-memory MemorySaver; callers that need bounded
+    memory pass their own (and own its lifecycle), e.g. an AsyncSqliteSaver.
     """
     
     # Build resources info for system prompt
     resources_info = ""
     if resources:
-        resources_info = "\n\nAvailable Database Schema:\n"
+        parts = ["\n\nAvailable Database Schema:"]
         for resource in resources:
-            if hasattr(resource, 'data') and resource.data:
-                resources_info += f"{resource.data}\n"
-            elif hasattr(resource, 'uri'):
-                resources_info += f"- {resource.uri}: Schema resource available\n"
+            data = getattr(resource, 'data', None)
+            uri = getattr(resource, 'uri', None)
+            if data:
+                parts.append(str(data))
+            elif uri is not None:
+                parts.append(f"- {uri}: Schema resource available")
             else:
-                resources_info += f"- {resource}: Resource available\n"
+                parts.append(f"- {resource}: Resource available")
+        resources_info = "\n".join(parts) + "\n"
     system_prompt = f"""You are CT agent, a helpful AI assistant specialized in generating and executing SQL queries against a PostgreSQL database using Prisma schema context.
    
 
@@ -94,7 +231,7 @@ IMPORTANT INSTRUCTIONS:
 
 4. **Primary Table**: The main table you'll work with is the "filings" table, which contains comprehensive filing information.
 
-5. **Company Context**: Always check for companyId: {companyId}
+5. **Company Context**: Always check for companyId: {{companyId}}
    - If companyId is "unknown", prompt the user to provide their company ID
    - When querying company-specific data, always filter by the appropriate company field
 
@@ -103,7 +240,7 @@ IMPORTANT INSTRUCTIONS:
    - Example: save to "/projects/report.txt" NOT "report.txt" or "/app/report.txt"
    - The filesystem is containerized and only allows access to the /projects directory
 
-    {resources_info}
+    {{resources_info}}
 
             <tools>
             {{tools}}
@@ -111,27 +248,24 @@ IMPORTANT INSTRUCTIONS:
 
 Generate appropriate SQL queries for user requests and ALWAYS seek human approval before executing them."""   
     
-    llm = ChatOpenAI(
-        model="gpt-4.1-mini-2025-04-14",
-        temperature=0.1,
-    )
+    llm = _base_llm()
     if tools:
         llm = llm.bind_tools(tools, parallel_tool_calls=False)
         # inject tools into system prompt
-        tools_json = [tool.model_dump_json(include=["name", "description"]) for tool in tools]
-        system_prompt = system_prompt.format(tools="\n".join(tools_json), companyId=companyId)
+        tools_json = [_dump_tool(tool) for tool in tools]
+        system_prompt = system_prompt.format(tools="\n".join(tools_json), companyId=companyId, resources_info=resources_info)
     else:
         # Format with empty tools and companyId
-        system_prompt = system_prompt.format(tools="", companyId=companyId)
+        system_prompt = system_prompt.format(tools="", companyId=companyId, resources_info=resources_info)
 
 
-    def assistant_node(state: PrismaAgentState) -> PrismaAgentState:
-        response = llm.invoke(
-            [SystemMessage(content=system_prompt)] +
-            state.messages
-            )
-        state.messages = state.messages + [response]
-        return state
+    # prompt is fixed once the graph is built, so build the message only once
+    system_message = SystemMessage(content=system_prompt)
+
+    def assistant_node(state: PrismaAgentState) -> dict:
+        response = llm.invoke([system_message, *state.messages])
+        # add_messages reducer appends this to the history, no need to copy it
+        return {"messages": [response]}
     
 
 
@@ -208,13 +342,17 @@ Generate appropriate SQL queries for user requests and ALWAYS seek human approva
         tool_call = last_message.tool_calls[-1]
 
         # Stop graph execution at this node and wait for human input
+        queries = _review_queries(tool_call.get("args", {}))
+
         human_review: dict = interrupt({
             "message": "Query execution requires your approval:",
             "tool_call": tool_call,
             "query_info": {
                 "type": "SQL Query",
                 "description": tool_call.get("args", {}).get("description", "Database query"),
-                "query": tool_call.get("args", {}).get("sql_query", "No query provided")
+                "query": "\n".join(query["sql_query"] for query in queries) or "No query provided",
+                # the reviewer must see what $1, $2, ... are bound to, not just the template
+                "queries": queries
             },
             "original_request": state.messages[0].content if state.messages else "No original request"
         })
@@ -222,52 +360,9 @@ Generate appropriate SQL queries for user requests and ALWAYS seek human approva
         review_action = human_review.get("action")
         review_data = human_review.get("data")
 
-        match review_action:
-            case ReviewAction.CONTINUE.value | "c" | "C":
-                # Approve the query execution as-is
-                return Command(goto="tools")
-                
-            case ReviewAction.UPDATE.value:
-                # Update the query parameters
-                if review_data is None:
-                    raise ValueError("update action requires data")
-
-                updated_message = AIMessage(
-                    content=last_message.content,
-                    tool_calls=[{
-                        "id": tool_call["id"],
-                        "name": tool_call["name"],
-                        "args": json.loads(review_data)
-                    }],
-                    id=last_message.id
-                )
-                return Command(goto="tools", update={"messages": [updated_message]})
-                
-            case ReviewAction.FEEDBACK.value:
-                # Send feedback to the Agent
-                if review_data is None:
-                    raise ValueError("feedback action requires data")
-
-                tool_message = ToolMessage(
-                    content=review_data,
-                    name=tool_call["name"],
-                    tool_call_id=tool_call["id"]
-                )
-                return Command(goto="assistant_node", update={"messages": [tool_message]})
-                
-            case ReviewAction.REJECT.value:
-                # Reject the query execution
-                tool_message = ToolMessage(
-                    content="The query execution was rejected by the user. Please ask for clarification or suggest alternative approaches.",
-                    name=tool_call["name"],
-                    tool_call_id=tool_call["id"]
-                )
-                return Command(goto="assistant_node", update={"messages": [tool_message]})
-                
-            case _:
-                #TODO: Handle we should probaably reject or somehting
-                # Default: continue with execution
-                return Command(goto="tools")
+        # TODO: unknown actions should probably reject; for now they continue with execution
+        handler = _REVIEW_HANDLERS.get(review_action, _review_continue)
+        return handler(last_message, tool_call, review_data)
 
     async def assistant_router(state: PrismaAgentState) -> str:
         last_message = state.messages[-1]
@@ -283,7 +378,7 @@ Generate appropriate SQL queries for user requests and ALWAYS seek human approva
 
     builder.add_node(assistant_node)
     builder.add_node(human_query_review_node)
-    builder.add_node("tools", ToolNode(tools))
+    builder.add_node("tools", _tool_node_for(_ToolsKey(tools)))
     builder.add_node("retry", retry_node)
     builder.add_node("fallback", tool_fall_back_node)
     builder.add_edge(START, "assistant_node")
@@ -299,7 +394,9 @@ Generate appropriate SQL queries for user requests and ALWAYS seek human approva
     builder.add_edge("retry", "tools")
 
     # Checkpointing is required for human-in-the-loop!
-    return builder.compile(checkpointer=MemorySaver())
+    if checkpointer is None:
+        checkpointer = MemorySaver()
+    return builder.compile(checkpointer=checkpointer)
 
 
 def create_graph_for_studio():
@@ -346,18 +443,6 @@ def compile_and_display_graph():
     return graph
 
 
-# ===== SELECT AND RUN THIS SECTION =====
-
-from dotenv import load_dotenv
-load_dotenv()
-graph = build_agent_graph()
-print("✅ Graph built!")
-print("🔍 Mermaid syntax:")
-print(graph.get_graph().draw_mermaid())
-
-# ===== not sure why the comments makes it work :() =====
-
-
 # visualize graph
 if __name__ == "__main__":
     from IPython.display import display, Image
@@ -365,4 +450,6 @@ if __name__ == "__main__":
     load_dotenv()
 
     graph = build_agent_graph()
+    print("🔍 Mermaid syntax:")
+    print(graph.get_graph().draw_mermaid())
     display(Image(graph.get_graph().draw_mermaid_png()))
\ No newline at end of file
@@ -6,79 +6,360 @@ A FastMCP-based server for executing SQL queries against PostgreSQL.
 Provides Prisma schema as context for query generation.
 """
 
+import asyncio
+import hashlib
+import json
 import os
+import re
+import sys
+from contextlib import asynccontextmanager, suppress
+from types import MappingProxyType
+from functools import lru_cache
 from typing import List, Optional
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
+from cachetools import TTLCache
+import aiofiles
+import asyncpg
 import httpx
+import sqlglot
+from sqlglot import exp
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 load_dotenv()
 
+ASSIGNMENTS_URL = "https://local.bloombergtax.com/filings/assignments"  #hard coded for now
+
+# assignor/assignee used when the agent doesn't provide one; read-only so no call can mutate it
+_DEFAULT_USER = MappingProxyType({"userId": "50196982", "firstName": "Soorena", "lastName": "Jahromi", "role": "admin"})
+
+# one long-lived HTTP/2 client so assignment calls reuse the connection instead of re-handshaking
+_HTTP_CLIENT = httpx.AsyncClient(
+    http2=True,
+    verify=False,
+    timeout=30.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=60.0),
+    headers={"apiKey": "Hail Soorena"},
+)
+
+
+# Upper bound on concurrent database work: callers queue here, ahead of the pool,
+# instead of piling up on pool.acquire(). The pool is sized to match.
+_DB_MAX_CONN = int(os.environ.get("DB_MAX_CONN", "10"))
+_DB_SEM = asyncio.Semaphore(_DB_MAX_CONN)
+
+# tables most queries touch (see the schema resource), primed at startup
+_HOT_TABLES = ("filings", "entities", "company_tax_year", "assignments")
+
+# Short-lived cache of SELECT results keyed on the query text + params.
+# Writes executed through this server evict the reads of the tables they touch;
+# SELECT_CACHE_TTL=0 disables it.
+_SELECT_CACHE_TTL = float(os.environ.get("SELECT_CACHE_TTL", "60"))
+_SELECT_CACHE = TTLCache(maxsize=512, ttl=_SELECT_CACHE_TTL) if _SELECT_CACHE_TTL > 0 else None
+# Bumped on every invalidation. A read only stores its result if no write invalidated the
+# cache while it was in flight, otherwise it could re-insert pre-write rows for a full TTL.
+_select_cache_generation = 0
+
+
+# read queries start with SELECT or a WITH clause; anchored so only the leading token is examined.
+# Only used when sqlglot can't parse the query.
+_SELECT_RE = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+# EXPLAIN ANALYZE (or ANALYSE, or inside an option list) actually runs the statement
+_EXPLAIN_ANALYZE_RE = re.compile(r"\s*(analy[sz]e\b|\([^)]*\banaly[sz]e\b)", re.IGNORECASE)
+# EXPLAIN options ahead of the explained statement: "(...)" lists and bare ANALYZE / VERBOSE
+_EXPLAIN_OPTIONS_RE = re.compile(r"^\s*(?:\([^)]*\)\s*|(?:analy[sz]e|verbose)\b\s*)*", re.IGNORECASE)
+
+_READ_KEYS = frozenset({"select", "union", "intersect", "except"})
+
+# functions whose result changes between calls; reads using them are never cached
+_VOLATILE_FUNCS = frozenset({
+    "now", "current_timestamp", "current_date", "current_time", "localtime", "localtimestamp",
+    "clock_timestamp", "statement_timestamp", "transaction_timestamp", "timeofday",
+    "rand", "random", "uuid", "gen_random_uuid",
+    "nextval", "currval", "lastval", "setval", "txid_current", "pg_sleep",
+})
+
+
+def _calls_volatile(tree) -> bool:
+    """True if the parsed statement calls any function in _VOLATILE_FUNCS"""
+    for func in tree.find_all(exp.Func):
+        name = func.name if isinstance(func, exp.Anonymous) else func.sql_name()
+        if name.lower() in _VOLATILE_FUNCS:
+            return True
+    return False
+
+
+@lru_cache(maxsize=1024)
+def _classify(sql_query: str) -> tuple[str, Optional[frozenset], bool]:
+    """Parse a query once and return (kind, tables it touches, cacheable).
+
+    kind is "read" for a single SELECT/set operation with no INSERT/UPDATE/DELETE anywhere
+    inside it (e.g. a data-modifying CTE), no INTO and no FOR UPDATE/SHARE, "explain" for a plain EXPLAIN, and "write" for
+    everything else. Table names are lowercased; None means they couldn't be determined.
+    cacheable is only true for reads that reference tables and call no volatile function
+    (e.g. now(), random(), nextval()), whose result could otherwise be served stale.
+    """
+    try:
+        statements = [tree for tree in sqlglot.parse(sql_query, read="postgres") if tree is not None]
+    except sqlglot.errors.SqlglotError:
+        return ("read" if _SELECT_RE.match(sql_query) else "write"), None, False
+
+    if not statements:
+        return "write", None, False
+
+    # sqlglot keeps EXPLAIN as an opaque Command; a plain EXPLAIN only plans, so it is a read
+    # on the tables of the statement it explains
+    if (
+        len(statements) == 1
+        and isinstance(statements[0], exp.Command)
+        and str(statements[0].this).upper() == "EXPLAIN"
+    ):
+        target = statements[0].expression.name if statements[0].expression else ""
+        _, target_tables, _ = _classify(_EXPLAIN_OPTIONS_RE.sub("", target, count=1))
+        if _EXPLAIN_ANALYZE_RE.match(target) is not None:
+            return "write", target_tables, False
+        return "explain", target_tables, bool(target_tables)
+
+    tables = frozenset(
+        table.name.lower()
+        for tree in statements
+        for table in tree.find_all(exp.Table)
+        if table.name
+    )
+    is_read = (
+        len(statements) == 1
+        and statements[0].key in _READ_KEYS
+        # SELECT ... INTO creates a table; FOR UPDATE/SHARE takes row locks
+        and statements[0].find(exp.Insert, exp.Update, exp.Delete, exp.Into, exp.Lock) is None
+    )
+    cacheable = is_read and bool(tables) and not _calls_volatile(statements[0])
+    return ("read" if is_read else "write"), tables, cacheable
+
+
+def _invalidate_select_cache(tables: Optional[frozenset]) -> None:
+    """Drop cached reads that touch any of the written tables (all of them if unknown)"""
+    global _select_cache_generation
+    if _SELECT_CACHE is None:
+        return
+    _select_cache_generation += 1
+    if not tables:
+        _SELECT_CACHE.clear()
+        return
+    for key, (_, _, read_tables) in list(_SELECT_CACHE.items()):
+        if read_tables is None or not read_tables.isdisjoint(tables):
+            _SELECT_CACHE.pop(key, None)
+
+
+def _select_cache_key(sql_query: str, params: Optional[list]) -> bytes:
+    """Cache key for a read query; only whitespace is normalized since literals are case-sensitive"""
+    normalized = " ".join(sql_query.split())
+    return hashlib.blake2b(f"{normalized}\x00{params!r}".encode()).digest()
+
+
+def _dumps(payload) -> str:
+    """Serialize a tool response to JSON, with orjson (dates/UUIDs handled in C) when available"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=str, option=orjson.OPT_NAIVE_UTC).decode()
+    return json.dumps(payload, default=str)
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Warm the database pool in the background; release it and the HTTP client on shutdown"""
+    warmup = asyncio.create_task(session.warmup())
+    try:
+        yield
+    finally:
+        warmup.cancel()
+        # let the task release its pooled connection / pool lock before the pool closes
+        with suppress(asyncio.CancelledError):
+            await warmup
+        await session.close()
+        await _HTTP_CLIENT.aclose()
+
+
 # Initialize FastMCP server
-mcp = FastMCP("postgresql")
+mcp = FastMCP("postgresql", lifespan=lifespan)
+
+
+# fallback served by the schema resource when the schema file can't be read
+_SCHEMA_MISSING_TPL = "Schema file not found at {path}. Please set PRISMA_SCHEMA_PATH environment variable or create schema.prisma file."
 
 
 class PostgreSQLSession:
     """Session for managing PostgreSQL operations with Prisma schema context"""
     
     def __init__(self):
+        # validated once here so a misconfigured server fails at startup, not on the first query
+        self.dsn = os.environ.get("DATABASE_URL")
+        if not self.dsn:
+            raise ValueError("Environment variable DATABASE_URL is not set")
         self.schema_path = os.environ.get("PRISMA_SCHEMA_PATH", "/Users/sj124894/playground/agents/mcp-sever/schema.prisma")
-        self.schema_content = self._load_schema()
+        # schema text cached against the file's mtime, see get_schema_content
+        self._schema_mtime_ns = None
+        self._schema_content = ""
+        # schema_path is fixed for the session, so the fallback text is built only once
+        self._schema_missing = _SCHEMA_MISSING_TPL.format(path=self.schema_path)
+        self._load_schema()
+        # shared asyncpg pool, created on first query
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
     
-    def _load_schema(self) -> str:
-        """Load the Prisma schema from file or return sample"""
-        if os.path.exists(self.schema_path):
+    def _load_schema(self):
+        """Preload the Prisma schema; a blocking read is fine here since the session is created at import, before the loop starts"""
+        try:
+            mtime_ns = os.stat(self.schema_path).st_mtime_ns
             with open(self.schema_path, 'r') as f:
-                return f.read()
-        else:
-            # Return a fallback message when schema file is not found
-            return f"Schema file not found at {self.schema_path}. Please set PRISMA_SCHEMA_PATH environment variable or create schema.prisma file."
-        
+                self._schema_content = f.read()
+        except OSError:
+            # missing file: get_schema_content serves the fallback message
+            return
+        self._schema_mtime_ns = mtime_ns
 
+    async def get_schema_content(self) -> str:
+        """Current Prisma schema text or a fallback message when the file is missing.
 
-    async def execute_sql_query(self, sql_query: str, description: str) -> str:
-        """Execute a raw SQL query against PostgreSQL - description will be required by AI"""
+        The file is re-read only when its mtime changes, with aiofiles so the event
+        loop isn't blocked on disk I/O.
+        """
         try:
-            import asyncpg
-        
-            database_url = os.environ.get("DATABASE_URL")
-            if not database_url:
-                return "Error: DATABASE_URL not configured"
-            
-            conn = await asyncpg.connect(database_url)
-            try:
-                # if it's a SELECT return results ,o.w execute it
-                sql_lower = sql_query.strip().lower()
-                
-                if sql_lower.startswith(('select', 'with')):
-                    # SELECT query - fetch results
-                    rows = await conn.fetch(sql_query)
-                    result = [dict(row) for row in rows]
-                    row_count = len(result)
-                    
-                    return f""" Query executed successfully!
-                        Description: {description}
-                        Query: {sql_query}
-                        Rows returned: {row_count}
-                        Results: {result[:10]}{'...' if row_count > 10 else ''}"""
-                                            
-                else:
-                    # INSERT/UPDATE/DELETE query
-                    result = await conn.execute(sql_query)
-                    
-                return f"""Query executed successfully!
-                Description: {description}
-                Query: {sql_query}
-                Result: {result}"""
-                        
-            finally:
-                await conn.close()
+            mtime_ns = os.stat(self.schema_path).st_mtime_ns
+        except OSError:
+            return self._schema_missing
+
+        if mtime_ns != self._schema_mtime_ns:
+            async with aiofiles.open(self.schema_path, 'r') as f:
+                self._schema_content = await f.read()
+            self._schema_mtime_ns = mtime_ns
+        return self._schema_content
+
+    async def _get_pool(self):
+        """Return the shared connection pool, creating it on first use"""
+        if self._pool is None:
+            async with self._pool_lock:
+                # another caller may have built it while we waited on the lock
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        dsn=self.dsn,
+                        min_size=min(2, _DB_MAX_CONN),
+                        max_size=_DB_MAX_CONN,
+                        command_timeout=30,
+                        statement_cache_size=1024,
+                        max_cached_statement_lifetime=0,
+                    )
+        return self._pool
+
+    async def warmup(self):
+        """Open the pool and prime type introspection / plans for the hot tables.
+
+        Best effort: a failure here only means the first real query pays the cost.
+        """
+        try:
+            pool = await self._get_pool()
+            async with _DB_SEM, pool.acquire() as conn:
+                await conn.fetchval("SELECT 1")
+                await conn.fetch(
+                    "SELECT table_name, column_name FROM information_schema.columns WHERE table_name = ANY($1::text[])",
+                    list(_HOT_TABLES),
+                )
+                for table in _HOT_TABLES:
+                    await conn.execute(f'EXPLAIN SELECT * FROM "{table}" LIMIT 0')
+        except Exception as e:
+            # stdout carries the MCP stdio protocol, so report on stderr
+            print(f"Database warmup failed: {type(e).__name__}: {e}", file=sys.stderr)
+
+    async def close(self):
+        """Close the connection pool if one was opened"""
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+
+    async def execute_sql_query(self, sql_query: str, description: str, params: Optional[list] = None) -> str:
+        """Execute a raw SQL query against PostgreSQL - description will be required by AI
+
+        Values passed in params are bound to $1, $2, ... placeholders, so repeated
+        query templates hit asyncpg's prepared statement cache.
+        """
+        try:
+            # if it's a SELECT return results ,o.w execute it
+            kind, tables, cacheable = _classify(sql_query)
+            is_select = kind != "write"
+
+            cache_key = None
+            generation = _select_cache_generation
+            cached = None
+            if is_select and cacheable and _SELECT_CACHE is not None:
+                cache_key = _select_cache_key(sql_query, params)
+                cached = _SELECT_CACHE.get(cache_key)
+
+            if cached is None:
+                pool = await self._get_pool()
+                async with _DB_SEM, pool.acquire() as conn:
+                    if kind == "explain":
+                        # EXPLAIN can't be DECLAREd as a cursor; plans are small, so keep every row
+                        rows = await conn.fetch(sql_query, *(params or []))
+                        cached = (len(rows), [dict(row) for row in rows], tables)
+                        if cache_key is not None and generation == _select_cache_generation:
+                            _SELECT_CACHE[cache_key] = cached
+                    elif is_select:
+                        # SELECT query - stream through a server-side cursor so only the
+                        # preview rows are kept in memory, whatever the result size
+                        preview = []
+                        row_count = 0
+                        async with conn.transaction():
+                            async for row in conn.cursor(sql_query, *(params or []), prefetch=1000):
+                                row_count += 1
+                                if row_count <= 10:
+                                    preview.append(dict(row))
+                        cached = (row_count, preview, tables)
+                        if cache_key is not None and generation == _select_cache_generation:
+                            _SELECT_CACHE[cache_key] = cached
+                    else:
+                        # INSERT/UPDATE/DELETE query
+                        result = await conn.execute(sql_query, *(params or []))
+                        # a write may change cached reads of the tables it touched
+                        _invalidate_select_cache(tables)
+
+            if is_select:
+                row_count, preview, _ = cached
+                return _dumps({
+                    "ok": True,
+                    "description": description,
+                    "query": sql_query,
+                    "row_count": row_count,
+                    "preview": preview,
+                })
+            else:
+                return _dumps({"ok": True, "description": description, "query": sql_query, "result": result})
                 
         except Exception as e:
-            return f"""| --- Query execution failed!
-Description: {description}
-Query: {sql_query}
-Error: {str(e)}"""
+            return _dumps({"ok": False, "description": description, "query": sql_query, "error": str(e)})
+
+
+    async def execute_sql_queries(self, queries: list[dict]) -> list[str]:
+        """Execute independent queries concurrently, each on its own pooled connection"""
+        # each query waits on _DB_SEM inside execute_sql_query, so the pool is never oversubscribed
+        results = await asyncio.gather(
+            *(
+                self.execute_sql_query(
+                    query.get("sql_query", ""),
+                    query.get("description", ""),
+                    query.get("params"),
+                )
+                for query in queries
+            ),
+            return_exceptions=True,
+        )
+        return [
+            result if isinstance(result, str) else _dumps({"ok": False, "error": str(result)})
+            for result in results
+        ]
 
 
 # Create session
@@ -98,85 +379,94 @@ async def get_schema() -> str:
     
     Use this resource BEFORE generating SQL queries to understand the database structure.
     """
-    # Manually return the table information to test if the issue is file reading
-    return """
-Database Tables Available:
-
-1. deleted_filing - Tracks deleted filing records
-2. filings - Main table containing comprehensive filing information
-3. company_tax_year - Company tax year information
-4. demo_mode_tracker - Tracks demo mode status
-5. custom_jurisdiction - Custom jurisdictions
-6. custom_entity_jurisdiction - Pivot table for custom entity jurisdictions
-7. entities - Entity information
-8. jurisdictions - Standard jurisdictions
-9. entity_jurisdictions - Pivot table for entity jurisdictions
-10. calendars - Calendar information for entities
-11. custom_filings - Custom filing records
-12. custom_forms - Custom form definitions
-13. company_custom_values - Custom values per company
-14. company_settings - Company settings
-15. company_custom_header - Custom headers per company
-16. user_preferences - User preference settings
-17. filings_snapshot - Snapshot of filings data
-18. assignments - Assignment records
-19. users - User information
-20. sign_offs - Sign-off records
-
-Key Field Mappings (Prisma camelCase → Database snake_case):
-- companyTaxYearId → company_tax_year_id
-- entityRecordId → entity_record_id
-- recordId → record_id
-- entityId → entity_id
-- deletedAt → deleted_at
-- deletedBy → deleted_by
-- createdAt → created_at
-- updatedAt → updated_at
-
-Main Tables for Queries:
-- filings: Primary table for filing data
-- entities: Entity information
-- company_tax_year: Tax year data
-- assignments: Assignment tracking
-"""
+    return await session.get_schema_content()
 
 
 @mcp.tool()
-async def executeQuery(sql_query: str, description: str) -> str:
+async def executeQuery(sql_query: str, description: str, params: Optional[list] = None) -> str:
     """Execute a raw SQL query against PostgreSQL database. Requires human approval for safety.
 
     Args:
-        sql_query: The raw SQL query to execute
+        sql_query: The raw SQL query to execute, using $1, $2, ... placeholders for values
         description: Human-readable description of what the query does
+        params: Optional values bound to the query placeholders, in order
+
+    Returns a JSON object with "ok", "description" and "query", plus:
+        - reads: "row_count" and "preview" (the first 10 rows as objects)
+        - writes: "result", the command status (e.g. "UPDATE 3")
+        - failures: "error"
     """
-    return await session.execute_sql_query(sql_query, description)
-
-
-async def assignFiling(companyTaxYearId:str ,assignor:Optional[dict], assignee:Optional[dict], recordIds: list[str] ) :
-    assignor = assignor or {"userId": "50196982", "firstName": "Soorena", "lastName": "Jahromi", "role": "admin"}
-    assignee = assignee or  {"userId": "50196982", "firstName": "Soorena", "lastName": "Jahromi", "role": "admin"}
-
-    """Assign records to a user"""
-    async with httpx.AsyncClient(http2=True, verify=False, timeout=30.0)  as client:
-        response = await client.post(
-            "https://local.bloombergtax.com/filings/assignments",  #hard coded for now 
-            headers={
-                "apiKey": "Hail Soorena"
-            },
-            json={
-                "companyTaxYearId": companyTaxYearId,
-                "assignor": assignor,
-                "assignee": assignee,
-                "recordIds": recordIds
-            }
-        )
-    return f"Records assigned from {assignor} to {assignee} for company tax year {companyTaxYearId}"
+    return await session.execute_sql_query(sql_query, description, params)
+
+
+@mcp.tool()
+async def executeQueries(queries: list[dict]) -> list[str]:
+    """Execute several independent SQL queries concurrently. Requires human approval for safety.
+
+    Args:
+        queries: List of {"sql_query": ..., "description": ..., "params": [...]} objects,
+            one per query; results are returned in the same order, each as the JSON
+            object described on executeQuery
+    """
+    return await session.execute_sql_queries(queries)
 
 
 @mcp.tool()
 async def assignFilingTool(companyTaxYearId: str, assignor: Optional[dict], assignee: Optional[dict], recordIds: Optional[list[str]] = None) -> str:
     """Tool to assign records to a user"""
-    return await assignFiling(companyTaxYearId, assignor, assignee, recordIds)
+    # mappingproxy isn't JSON serializable, so the read-only defaults are copied on use
+    assignor = assignor or dict(_DEFAULT_USER)
+    assignee = assignee or dict(_DEFAULT_USER)
+
+    response = await _HTTP_CLIENT.post(
+        ASSIGNMENTS_URL,
+        json={
+            "companyTaxYearId": companyTaxYearId,
+            "assignor": assignor,
+            "assignee": assignee,
+            "recordIds": recordIds
+        }
+    )
+    return f"Records assigned from {assignor} to {assignee} for company tax year {companyTaxYearId}"
+
+
+@mcp.tool()
+async def assignFilingsBatch(items: list[dict]) -> list[str]:
+    """Tool to make several record assignments at once, sent concurrently over one HTTP/2 connection
+
+    Args:
+        items: List of {"companyTaxYearId": ..., "recordIds": [...], "assignor": {...}, "assignee": {...}}
+            objects; assignor/assignee are optional. Results are returned in the same order.
+    """
+    payloads = [
+        {
+            "companyTaxYearId": item.get("companyTaxYearId"),
+            "assignor": item.get("assignor") or dict(_DEFAULT_USER),
+            "assignee": item.get("assignee") or dict(_DEFAULT_USER),
+            "recordIds": item.get("recordIds"),
+        }
+        for item in items
+    ]
+    responses = await asyncio.gather(
+        *(_HTTP_CLIENT.post(ASSIGNMENTS_URL, json=payload) for payload in payloads),
+        return_exceptions=True,
+    )
+
+    results = []
+    for payload, response in zip(payloads, responses):
+        if isinstance(response, Exception):
+            results.append(f"Assignment failed for company tax year {payload['companyTaxYearId']}: {response}")
+        elif response.is_error:
+            results.append(f"Assignment failed for company tax year {payload['companyTaxYearId']}: HTTP {response.status_code}")
+        else:
+            results.append(f"Records assigned from {payload['assignor']} to {payload['assignee']} for company tax year {payload['companyTaxYearId']}")
+    return results
 
 if __name__ == "__main__":
-    mcp.run(transport='stdio')
+    # libuv-based loop for the asyncpg/httpx network paths, when installed (not on Windows)
+    try:
+        import uvloop
+    except ImportError:
+        mcp.run(transport='stdio')
+    else:
+        uvloop.run(mcp.run_stdio_async())